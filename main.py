@@ -7,30 +7,50 @@ Display e-paper per trasporti pubblici Milano - Piazza Ferravilla
 Richiede: Raspberry Pi + Waveshare 7.5” e-paper display
 """
 
-import io
+import codecs
+import json
+import queue
 import shutil
 import subprocess
+import threading
 import time
 import zipfile
 from datetime import datetime, timedelta
 from pathlib import Path
+from types import SimpleNamespace
 import logging
 from logging.handlers import RotatingFileHandler
-import re
 
 import requests
-import partridge as ptg
 from PIL import Image, ImageDraw, ImageFont
 
 # ===== CONFIGURAZIONE =====
 
 UPDATE_INTERVAL = 120  # Aggiorna ogni N secondi
+POLL_INTERVAL = 30  # Controlla l'aggiornamento GTFS ogni N secondi (thread separato)
+FULL_REFRESH_INTERVAL_S = 3600  # Refresh completo (init + Clear) al massimo ogni N secondi
 GTFS_URL = "https://dati.comune.milano.it/gtfs.zip"
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB per lettura durante il download
 GTFS_PATH = Path(__file__).resolve().parent / "data" / "gtfs"
+GTFS_CACHE_PATH = GTFS_PATH / "filtered.pkl"
+GTFS_CACHE_META_PATH = GTFS_PATH / "filtered.json"
+DISPLAY_WIDTH, DISPLAY_HEIGHT = 800, 480  # Waveshare 7.5”
 LOG_PATH = Path(__file__).resolve().parent / "atm_display.log"
 LOG_MAX_BYTES = 10 * 1024 * 1024
 LOG_BACKUP_COUNT = 3
 TARGET_STOPS = [12422, 12423, 12424, 12425, 12170]
+TARGET_STOP_IDS = [str(s) for s in TARGET_STOPS]  # stop_id GTFS sono stringhe
+
+# Colonne del DataFrame filtrato (e della sua cache su disco)
+FILTERED_COLUMNS = ["stop_id", "_arr_s", "_dest", "_line", "direzione"]
+
+# Unici file e colonne GTFS effettivamente usati
+GTFS_FEED_COLUMNS = {
+    "stops": ["stop_id", "stop_name"],
+    "trips": ["trip_id", "route_id", "service_id", "trip_headsign", "direction_id"],
+    "routes": ["route_id", "route_short_name", "route_long_name"],
+    "stop_times": ["trip_id", "arrival_time", "stop_id", "stop_headsign"],
+}
 
 handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
 console_handler = logging.StreamHandler()
@@ -44,6 +64,13 @@ logger = logging.getLogger(__name__)
 # Stato display Waveshare
 _epd_device = None
 _update_counter = 0
+_last_full_refresh = None  # time.monotonic() dell'ultimo refresh completo
+
+# Larghezze del testo già misurate, per (font, testo)
+_text_width_cache = {}
+
+# Testi ricorrenti già rasterizzati (maschera, offset bbox), per (font, testo)
+_glyph_cache = {}
 
 # Font (usa font di sistema o scarica Roboto/Arial)
 try:
@@ -58,30 +85,79 @@ except OSError:
     # font_medium = ImageFont.load_default()
     # font_small = ImageFont.load_default()
 
-def download_gtfs_data():
+def download_gtfs_data(target_stops=None):
     """
     Scarica e estrae i dati GTFS dal portale open data di Milano.
+    stop_times.txt viene filtrato durante l'estrazione: su disco finiscono solo
+    le righe delle fermate target.
     """
+    if target_stops is None:
+        target_stops = TARGET_STOP_IDS
+
     logger.info("Download dati GTFS da %s...", GTFS_URL)
 
-    response = requests.get(GTFS_URL, timeout=60)
-    response.raise_for_status()
+    # Scarica lo zip su disco a blocchi grandi, accanto alla directory dei dati
+    zip_path = GTFS_PATH.with_name("gtfs.zip.part")
+    zip_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with requests.get(GTFS_URL, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with zip_path.open("wb") as out:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    out.write(chunk)
+
+        # Rimuovi directory esistente e ricrea
+        if GTFS_PATH.exists():
+            shutil.rmtree(GTFS_PATH)
+        GTFS_PATH.mkdir(parents=True, exist_ok=True)
+
+        # Estrai il contenuto dello zip, filtrando stop_times.txt al volo
+        with zipfile.ZipFile(zip_path) as zf:
+            for member in zf.infolist():
+                if member.is_dir():
+                    continue
+                if Path(member.filename).name == "stop_times.txt":
+                    _extract_filtered_stop_times(zf, member, GTFS_PATH / Path(member.filename).name, target_stops)
+                else:
+                    zf.extract(member, GTFS_PATH)
+    finally:
+        zip_path.unlink(missing_ok=True)
 
-    # Rimuovi directory esistente e ricrea
-    if GTFS_PATH.exists():
-        shutil.rmtree(GTFS_PATH)
-    GTFS_PATH.mkdir(parents=True, exist_ok=True)
+    logger.info("Dati GTFS estratti in %s", GTFS_PATH)
 
-    # Estrai il contenuto dello zip
-    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
-        zf.extractall(GTFS_PATH)
 
-    logger.info("Dati GTFS estratti in %s", GTFS_PATH)
+def _extract_filtered_stop_times(zf, member, dest_path, target_stops):
+    """
+    Copia stop_times.txt dallo zip a dest_path tenendo solo le righe delle fermate target.
+    """
+    target_ids = {str(s).encode() for s in target_stops}
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with zf.open(member) as src, dest_path.open("wb") as out:
+        header = src.readline()
+        out.write(header)
+        columns = [c.strip().strip(b'"') for c in header.lstrip(codecs.BOM_UTF8).split(b",")]
+
+        if not target_ids or b"stop_id" not in columns:
+            logger.warning("stop_times.txt non filtrabile: estratto per intero")
+            shutil.copyfileobj(src, out)
+            return
+
+        stop_idx = columns.index(b"stop_id")
+        kept = 0
+        for line in src:
+            fields = line.split(b",", stop_idx + 1)
+            if len(fields) > stop_idx and fields[stop_idx].strip().strip(b'"') in target_ids:
+                out.write(line)
+                kept += 1
+
+    logger.info("stop_times.txt: %d righe estratte per %d fermate target", kept, len(target_ids))
 
 
 def filter_stop_times_file(stop_times_path: Path, target_stops):
     """
-    Usa grep per ridurre stop_times.txt alle sole righe per le fermate target.
+    Usa grep -F (o ripgrep, se disponibile) per ridurre stop_times.txt alle sole
+    righe per le fermate target.
     Restituisce il path (eventualmente filtrato) da usare nel feed.
     """
     if not stop_times_path.exists():
@@ -102,37 +178,20 @@ def filter_stop_times_file(stop_times_path: Path, target_stops):
         return stop_times_path
 
     filtered_path = stop_times_path.with_name("stop_times.filtered.txt")
-    pattern = rf"\b({'|'.join(map(re.escape, target_ids))})\b"
+    patterns_path = stop_times_path.with_name("stop_ids.patterns")
 
     try:
-        match_count = None
-        count_cmd = ["grep", "-E", "-c", pattern, str(stop_times_path)]
-        logger.info("Comando grep (conteggio): %s", " ".join(count_cmd))
-        count_result = subprocess.run(
-            count_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=False,
-        )
-        if count_result.returncode in (0, 1):
-            try:
-                match_count = int(count_result.stdout.strip() or 0)
-            except ValueError:
-                logger.warning("Impossibile parsare il conteggio delle righe grep: %r", count_result.stdout.strip())
+        # Stringhe fisse (-F) su parole intere (-w): niente motore regex
+        patterns_path.write_text("\n".join(target_ids) + "\n", encoding="utf-8")
+        if shutil.which("rg"):
+            grep_cmd = ["rg", "--no-config", "-F", "-w", "-f", str(patterns_path), str(stop_times_path)]
         else:
-            logger.warning("Conteggio grep su stop_times.txt fallito (code %s): %s", count_result.returncode, count_result.stderr.strip())
-
-        if match_count == 0:
-            logger.warning("grep su stop_times.txt ha trovato 0 righe: file lasciato intatto")
-            return stop_times_path
+            grep_cmd = ["grep", "-F", "-w", "-f", str(patterns_path), str(stop_times_path)]
 
         # Scrive prima l'header, poi appende le righe filtrate
-        if header:
-            with filtered_path.open("w", encoding="utf-8") as dest:
-                dest.write(header)
-        grep_cmd = ["grep", "-E", pattern, str(stop_times_path)]
-        logger.info("Comando grep (estrazione): %s", " ".join(grep_cmd))
+        with filtered_path.open("w", encoding="utf-8") as dest:
+            dest.write(header)
+        logger.info("Comando filtro: %s", " ".join(grep_cmd))
         with filtered_path.open("a", encoding="utf-8") as dest:
             result = subprocess.run(
                 grep_cmd,
@@ -142,22 +201,80 @@ def filter_stop_times_file(stop_times_path: Path, target_stops):
                 check=False,
             )
 
-        if result.returncode not in (0, 1):
-            logger.warning("grep su stop_times.txt fallito (code %s): %s", result.returncode, result.stderr.strip())
+        if result.returncode == 1:
+            logger.warning("Filtro su stop_times.txt ha trovato 0 righe: file lasciato intatto")
             filtered_path.unlink(missing_ok=True)
             return stop_times_path
 
-        if match_count is not None:
-            logger.info("stop_times.txt: %d righe corrispondono alle fermate target", match_count)
+        if result.returncode != 0:
+            logger.warning("Filtro su stop_times.txt fallito (code %s): %s", result.returncode, result.stderr.strip())
+            filtered_path.unlink(missing_ok=True)
+            return stop_times_path
 
         shutil.move(filtered_path, stop_times_path)
-        logger.info("stop_times.txt filtrato con grep per %d fermate target", len(target_ids))
+        logger.info("stop_times.txt filtrato per %d fermate target (%d byte)", len(target_ids), stop_times_path.stat().st_size)
         return stop_times_path
 
     except Exception:
         logger.exception("Errore durante il filtraggio di stop_times.txt")
         filtered_path.unlink(missing_ok=True)
         return stop_times_path
+    finally:
+        patterns_path.unlink(missing_ok=True)
+
+
+def _read_gtfs_csv(path, columns=None):
+    """Legge un file GTFS come stringhe, limitandosi alle colonne richieste se indicate."""
+    import pandas as pd
+
+    usecols = None if columns is None else set(columns).__contains__
+    df = pd.read_csv(path, usecols=usecols, dtype=str, encoding="utf-8-sig", skipinitialspace=True)
+    # Colonne opzionali assenti nel feed diventano colonne vuote
+    return df if columns is None else df.reindex(columns=columns)
+
+
+def load_feed_lite(path):
+    """
+    Carica solo i file GTFS necessari (stops, trips, routes, stop_times) e solo
+    le colonne usate. Restituisce un oggetto con un attributo per tabella.
+    """
+    path = Path(path)
+    return SimpleNamespace(**{
+        name: _read_gtfs_csv(path / f"{name}.txt", columns)
+        for name, columns in GTFS_FEED_COLUMNS.items()
+    })
+
+
+def read_service_ids_by_date(path):
+    """
+    Ricostruisce da calendar.txt e calendar_dates.txt i service_id attivi per data.
+    Restituisce un dict {date: frozenset(service_id)}.
+    """
+    path = Path(path)
+    weekdays = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    service_ids_by_date = {}
+
+    calendar_path = path / "calendar.txt"
+    if calendar_path.exists():
+        for row in _read_gtfs_csv(calendar_path).to_dict("records"):
+            day = datetime.strptime(row["start_date"], "%Y%m%d").date()
+            end_date = datetime.strptime(row["end_date"], "%Y%m%d").date()
+            active_weekdays = [row.get(name) == "1" for name in weekdays]
+            while day <= end_date:
+                if active_weekdays[day.weekday()]:
+                    service_ids_by_date.setdefault(day, set()).add(row["service_id"])
+                day += timedelta(days=1)
+
+    calendar_dates_path = path / "calendar_dates.txt"
+    if calendar_dates_path.exists():
+        for row in _read_gtfs_csv(calendar_dates_path).to_dict("records"):
+            day = datetime.strptime(row["date"], "%Y%m%d").date()
+            if row["exception_type"] == "1":
+                service_ids_by_date.setdefault(day, set()).add(row["service_id"])
+            elif row["exception_type"] == "2":
+                service_ids_by_date.setdefault(day, set()).discard(row["service_id"])
+
+    return {day: frozenset(ids) for day, ids in service_ids_by_date.items() if ids}
 
 
 # ===== FUNZIONI API =====
@@ -168,7 +285,7 @@ def get_nearby_stops(feed, target_stops=None):
     Restituisce solo le fermate elencate in target_stops.
     """
     if target_stops is None:
-        target_stops = TARGET_STOPS
+        target_stops = TARGET_STOP_IDS
 
     target_stop_ids = [str(s) for s in target_stops]
 
@@ -190,34 +307,51 @@ def get_nearby_stops(feed, target_stops=None):
         return []
 
 
-def parse_gtfs_time(time_value, base_date):
+def _arrival_seconds(arrival_time):
     """
-    Parses GTFS time (seconds since midnight as float) to datetime.
-    Handles times > 24h (next day service).
+    Converte la colonna arrival_time GTFS in secondi dalla mezzanotte.
+    Accetta sia secondi numerici sia stringhe "HH:MM:SS".
+    Valori non parsabili diventano NaN.
     """
-    try:
-        if isinstance(time_value, (int, float)):
-            total_seconds = int(time_value)
-        else:
-            # Fallback for string format "HH:MM:SS"
-            h, m, s = map(int, str(time_value).split(":"))
-            total_seconds = h * 3600 + m * 60 + s
-    except (ValueError, TypeError):
-        return None
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(arrival_time):
+        return arrival_time
+
+    hms = arrival_time.astype("string").str.strip().str.split(":", expand=True)
+    if hms.shape[1] != 3:
+        return pd.Series(float("nan"), index=arrival_time.index)
+    hms = hms.apply(pd.to_numeric, errors="coerce")
+    return hms[0] * 3600 + hms[1] * 60 + hms[2]
+
+
+def _coalesce_columns(df, columns, default):
+    """
+    Restituisce, riga per riga, il primo valore non vuoto tra le colonne indicate.
+    Colonne mancanti vengono ignorate; se nessun valore è presente usa default.
+    """
+    import pandas as pd
+
+    result = pd.Series(default, index=df.index, dtype="object")
+    for column in reversed(columns):
+        if column not in df:
+            continue
+        values = df[column].fillna("").astype(str)
+        result = values.where(values != "", result)
+    return result
 
-    days_offset, remaining_seconds = divmod(total_seconds, 86400)
-    return datetime.combine(base_date, datetime.min.time()) + timedelta(days=days_offset, seconds=remaining_seconds)
 
 def filter_stop_times(feed, stops, service_ids_by_date):
     """
     Filtra i dati GTFS per le fermate specificate e li prepara per le query.
     Eseguito una sola volta all'avvio per ridurre il dataset in memoria.
 
-    Restituisce un DataFrame con stop_times già uniti a trips e routes.
+    Restituisce un DataFrame ridotto (FILTERED_COLUMNS) con orario in secondi,
+    destinazione, linea e direzione già risolti da stop_times, trips, routes e stops.
     """
     import pandas as pd
 
-    stop_map = {str(s.get("stop_id")): s for s in stops}
+    stop_map = {s["stop_id"]: s for s in stops}
     stop_ids = list(stop_map.keys())
 
     if not stop_ids:
@@ -225,17 +359,14 @@ def filter_stop_times(feed, stops, service_ids_by_date):
 
     try:
         # Filter by today's service patterns
+        # Prima le fermate (molto selettivo), poi i trip attivi sul risultato ridotto
+        stop_times = feed.stop_times[feed.stop_times["stop_id"].isin(stop_ids)]
+
         today = datetime.now().date()
         if service_ids_by_date and today in service_ids_by_date:
             service_ids = list(service_ids_by_date[today])
             active_trips = feed.trips[feed.trips["service_id"].isin(service_ids)]
-            active_trip_ids = set(active_trips["trip_id"])
-            stop_times = feed.stop_times[
-                (feed.stop_times["stop_id"].isin(stop_ids)) &
-                (feed.stop_times["trip_id"].isin(active_trip_ids))
-            ]
-        else:
-            stop_times = feed.stop_times[feed.stop_times["stop_id"].isin(stop_ids)]
+            stop_times = stop_times[stop_times["trip_id"].isin(active_trips["trip_id"])]
 
         if stop_times.empty:
             return pd.DataFrame(), stop_map
@@ -246,91 +377,117 @@ def filter_stop_times(feed, stops, service_ids_by_date):
 
         merged = stop_times.merge(trips, on="trip_id", how="left").merge(routes, on="route_id", how="left")
 
-        logger.info("Dataset filtrato: %d righe per %d fermate", len(merged), len(stop_ids))
-        return merged, stop_map
+        # Campi derivati calcolati una sola volta: orario in secondi, destinazione e linea
+        merged["_arr_s"] = _arrival_seconds(merged["arrival_time"])
+        merged["_dest"] = _coalesce_columns(
+            merged, ["stop_headsign", "trip_headsign", "route_long_name"], "Destinazione non disponibile"
+        )
+        merged["_line"] = _coalesce_columns(merged, ["route_short_name", "route_id"], "Linea")
+        merged = merged.dropna(subset=["_arr_s"])
+
+        # Direzione della fermata come colonna, al posto del lookup in stop_map a ogni ciclo
+        stops_df = pd.DataFrame(stops, columns=["stop_id", "direzione"])
+        merged = merged.merge(stops_df, on="stop_id", how="left")
+        merged["direzione"] = merged["direzione"].fillna(merged["_dest"])
+
+        # Poche fermate/linee/destinazioni distinte: category invece di stringhe per riga
+        slim = merged[FILTERED_COLUMNS].astype({
+            "_arr_s": "int64",
+            "stop_id": "category",
+            "_dest": "category",
+            "_line": "category",
+            "direzione": "category",
+        })
+
+        logger.info("Dataset filtrato: %d righe per %d fermate", len(slim), len(stop_ids))
+        return slim, stop_map
 
     except Exception:
         logger.exception("Errore filtraggio dati")
         return pd.DataFrame(), stop_map
 
 
-def get_next_arrivals(stop_times_df, stop_map):
+def get_next_arrivals(stop_times_df, now=None):
     """
     Interroga i dati pre-filtrati per trovare i prossimi 2 arrivi per linea/destinazione.
-    Eseguito ad ogni ciclo di aggiornamento.
+    Eseguito ad ogni ciclo di aggiornamento; now è l'istante di riferimento del ciclo.
     """
     import pandas as pd
 
     if stop_times_df.empty:
         return []
 
-    now = datetime.now()
-
-    arrivals_by_line = {}
-
-    for _, row in stop_times_df.iterrows():
-        sid = row["stop_id"]
-        arrival_dt = parse_gtfs_time(row.get("arrival_time", ""), now.date())
-        if not arrival_dt:
-            continue
-        if arrival_dt < now:
-            continue  # Skip past arrivals
-
-        minutes = int((arrival_dt - now).total_seconds() // 60)
-        if minutes > 120:
-            continue  # Don't list arrivals that far ahead
-
-        def get_str(val, default=""):
-            if pd.isna(val):
-                return default
-            return str(val) if val else default
-
-        destination = get_str(row.get("stop_headsign")) or get_str(row.get("trip_headsign")) or get_str(row.get("route_long_name")) or "Destinazione non disponibile"
-        line_label = get_str(row.get("route_short_name")) or get_str(row.get("route_id")) or "Linea"
-
-        stop_info = stop_map.get(sid, {})
-
-        arrival_entry = {
-            "line": line_label,
-            "direzione": stop_info.get("direzione", destination),
-            "stop_id": sid,
-            "destination": destination,
-            "minutes": minutes
-        }
-
-        # Group by line + destination
-        group_key = (line_label, destination)
-        if group_key not in arrivals_by_line:
-            arrivals_by_line[group_key] = []
-        arrivals_by_line[group_key].append(arrival_entry)
-
-    # Limit to next 2 arrivals per line+destination
-    results = []
-    for group_key, items in arrivals_by_line.items():
-        items.sort(key=lambda a: a["minutes"])
-        results.extend(items[:2])
-
-    results.sort(key=lambda a: a["minutes"])
-    return results
+    if now is None:
+        now = datetime.now()
+    now_s = now.hour * 3600 + now.minute * 60 + now.second
+
+    # Calcolo vettoriale: niente iterazione riga per riga
+    delta = stop_times_df["_arr_s"].to_numpy() - now_s
+    minutes = delta // 60
+    mask = (delta >= 0) & (minutes <= 120)  # Salta arrivi passati o troppo lontani
+
+    upcoming = stop_times_df.loc[mask, ["stop_id", "_dest", "_line", "direzione"]].assign(minutes=minutes[mask])
+
+    # Limit to next 2 arrivals per line+destination, sorted by minutes
+    upcoming = (
+        upcoming.sort_values("minutes", kind="stable")
+        .groupby(["_line", "_dest"], sort=False, observed=True)
+        .head(2)
+    )
+
+    results = pd.DataFrame({
+        "line": upcoming["_line"].astype(str),
+        "direzione": upcoming["direzione"].astype(str),
+        "stop_id": upcoming["stop_id"].astype(str),
+        "destination": upcoming["_dest"].astype(str),
+        "minutes": upcoming["minutes"],
+    })
+    return results.to_dict(orient="records")
 # Retro-compatibilità: alias per uso semplificato
 
 def get_arrivals(feed, service_ids_by_date, stop_id=None):
     stops = get_nearby_stops(feed)
     # Se viene passato un singolo stop_id, filtra la lista, altrimenti usa tutte le fermate
     if stop_id is not None:
-        stops = [s for s in stops if str(s.get("stop_id")) == str(stop_id)] or stops
-    stop_times_df, stop_map = filter_stop_times(feed, stops, service_ids_by_date)
-    return get_next_arrivals(stop_times_df, stop_map)
+        stops = [s for s in stops if s["stop_id"] == str(stop_id)] or stops
+    stop_times_df, _ = filter_stop_times(feed, stops, service_ids_by_date)
+    return get_next_arrivals(stop_times_df)
 
 
 # ===== FUNZIONI DISPLAY =====
 
-def create_display_image(arrivals):
+def _text_width(font, text):
+    """Larghezza in pixel di text con font, memorizzata per le stringhe ricorrenti."""
+    key = (id(font), text)
+    width = _text_width_cache.get(key)
+    if width is None:
+        bbox = font.getbbox(text, mode="1")  # stessa modalità di textbbox su immagini "1"
+        width = _text_width_cache[key] = bbox[2] - bbox[0]
+    return width
+
+
+def _draw_cached_text(image, xy, text, font):
     """
-    Crea immagine per display e-paper 7.5” (800x480)
+    Disegna text in nero come draw.text, ma incollando una maschera
+    rasterizzata una sola volta per ogni (font, testo).
     """
-    # Dimensioni display Waveshare 7.5”
-    width, height = 800, 480
+    key = (id(font), text)
+    glyph = _glyph_cache.get(key)
+    if glyph is None:
+        left, top, right, bottom = font.getbbox(text, mode="1")
+        mask = Image.new('1', (max(right - left, 1), max(bottom - top, 1)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+        glyph = _glyph_cache[key] = (mask, left, top)
+
+    mask, left, top = glyph
+    image.paste(0, (xy[0] + left, xy[1] + top), mask)
+
+
+def _create_static_background():
+    """
+    Disegna una sola volta gli elementi fissi (header, separatori, footer).
+    """
+    width, height = DISPLAY_WIDTH, DISPLAY_HEIGHT
 
     # Crea immagine bianca
     image = Image.new('1', (width, height), 255)  # '1' = monocromatico
@@ -339,13 +496,35 @@ def create_display_image(arrivals):
     # Header
     draw.text((20, 10), "PROSSIME PARTENZE", font=font_large, fill=0)
 
-    # Ora corrente
-    now = datetime.now().strftime("%H:%M")
-    draw.text((width-150, 10), now, font=font_medium, fill=0)
-
     # Linea separatrice
     draw.line([(20, 50), (width-20, 50)], fill=0, width=3)
 
+    # Footer
+    draw.line([(20, height-40), (width-20, height-40)], fill=0, width=2)
+    draw.text((20, height-30), "Aggiornamento automatico ogni 2 minuti",
+            font=font_small, fill=0)
+
+    return image
+
+
+_STATIC_BACKGROUND = _create_static_background()
+
+
+def create_display_image(arrivals, now=None):
+    """
+    Crea immagine per display e-paper 7.5” (800x480)
+    partendo dallo sfondo statico precalcolato.
+    """
+    width, height = DISPLAY_WIDTH, DISPLAY_HEIGHT
+    if now is None:
+        now = datetime.now()
+
+    image = _STATIC_BACKGROUND.copy()
+    draw = ImageDraw.Draw(image)
+
+    # Ora corrente
+    draw.text((width-150, 10), now.strftime("%H:%M"), font=font_medium, fill=0)
+
     # Raggruppa arrivi per line/destination
     y_offset = 85
     line_height = 60
@@ -377,10 +556,8 @@ def create_display_image(arrivals):
 
             # Line text
             line_text = str(line)
-            bbox = draw.textbbox((0, 0), line_text, font=font_medium)
-            text_width = bbox[2] - bbox[0]
-            draw.text((circle_x - text_width//2, circle_y-11),
-                    line_text, font=font_medium, fill=0)
+            text_width = _text_width(font_medium, line_text)
+            _draw_cached_text(image, (circle_x - text_width//2, circle_y-11), line_text, font_medium)
 
             # Destination
             destination = " ".join([s.capitalize() for s in destination.split()])
@@ -396,19 +573,14 @@ def create_display_image(arrivals):
                     return f"{minutes} min"
 
             time1 = format_minutes(items[0]["minutes"])
-            draw.text((width-280, y_offset), time1, font=font_medium, fill=0)
+            _draw_cached_text(image, (width-280, y_offset), time1, font_medium)
 
             if len(items) > 1:
                 time2 = format_minutes(items[1]["minutes"])
-                draw.text((width-130, y_offset), time2, font=font_medium, fill=0)
+                _draw_cached_text(image, (width-130, y_offset), time2, font_medium)
 
             y_offset += line_height
 
-    # Footer
-    draw.line([(20, height-40), (width-20, height-40)], fill=0, width=2)
-    draw.text((20, height-30), "Aggiornamento automatico ogni 2 minuti",
-            font=font_small, fill=0)
-
     return image
 
 
@@ -427,23 +599,44 @@ def _get_epd():
     return _epd_device
 
 
+# Tabella per invertire tutti i bit di un byte (PIL: 1 = bianco, pannello: 1 = nero)
+_INVERT_BYTES = bytes(255 - i for i in range(256))
+
+
+def _image_buffer(epd, image):
+    """
+    Buffer 1-bpp per il pannello ricavato direttamente da Image.tobytes().
+    Stesso layout di epd.getbuffer() (MSB a sinistra, bit invertiti) senza il
+    ciclo Python sui byte; come getbuffer ruota le immagini verticali e
+    converte le altre modalità in '1'.
+    """
+    if image.size == (epd.height, epd.width):
+        image = image.rotate(90, expand=True)
+    elif image.size != (epd.width, epd.height):
+        logger.warning("Immagine %dx%d diversa dal display %dx%d", *image.size, epd.width, epd.height)
+    if image.mode != "1":
+        image = image.convert("1")
+    return image.tobytes().translate(_INVERT_BYTES)
+
+
 def update_display(image):
     """
-    Aggiorna il display e-paper.
-    Init eseguito una sola volta; Clear ogni 10 aggiornamenti.
+    Aggiorna il display e-paper con un refresh parziale.
+    init + Clear solo al primo aggiornamento, dopo FULL_REFRESH_INTERVAL_S
+    o quando _last_full_refresh viene azzerato (es. ricarica GTFS).
     """
-    global _update_counter
+    global _update_counter, _last_full_refresh
     try:
         epd = _get_epd()
-    
-        # Pulizia ogni 10 aggiornamenti (incluso il primo)
-        if _update_counter % 10 == 0:
+
+        now = time.monotonic()
+        if _last_full_refresh is None or now - _last_full_refresh > FULL_REFRESH_INTERVAL_S:
             epd.init()
             epd.Clear()
-            # epd.display(epd.getbuffer(image))
-        # else:
+            _last_full_refresh = now
+            logger.info("Refresh completo del display")
         epd.init_part()
-        epd.display_Partial(epd.getbuffer(image), 0, 0, epd.width, epd.height)
+        epd.display_Partial(_image_buffer(epd, image), 0, 0, epd.width, epd.height)
         epd.sleep()
 
         _update_counter += 1
@@ -457,15 +650,80 @@ def update_display(image):
 
 # ===== MAIN LOOP =====
 
+def _filtered_cache_key():
+    """
+    Chiave di validità della cache: mtime di stop_times.txt, fermate target, colonne e
+    giorno di servizio (il filtro per service_id dipende dalla data).
+    """
+    stop_times_path = GTFS_PATH / "stop_times.txt"
+    if not stop_times_path.exists():
+        return None
+    return {
+        "stop_times_mtime_ns": stop_times_path.stat().st_mtime_ns,
+        "targets": TARGET_STOP_IDS,
+        "columns": FILTERED_COLUMNS,
+        "service_date": datetime.now().date().isoformat(),
+    }
+
+
+def load_filtered_cache():
+    """
+    Restituisce (stop_times_df, stop_map) dalla cache su disco se ancora valida,
+    altrimenti None.
+    """
+    import pandas as pd
+
+    key = _filtered_cache_key()
+    if key is None or not GTFS_CACHE_PATH.exists() or not GTFS_CACHE_META_PATH.exists():
+        return None
+
+    try:
+        if json.loads(GTFS_CACHE_META_PATH.read_text(encoding="utf-8")) != key:
+            logger.info("Cache dati filtrati non aggiornata: ricarico il feed")
+            return None
+        cached = pd.read_pickle(GTFS_CACHE_PATH)
+        return cached["stop_times"], cached["stop_map"]
+    except Exception:
+        logger.exception("Cache dati filtrati non leggibile: ricarico il feed")
+        return None
+
+
+def save_filtered_cache(stop_times_df, stop_map):
+    """
+    Salva i dati filtrati su disco con il sidecar JSON che ne descrive la validità.
+    """
+    import pandas as pd
+
+    key = _filtered_cache_key()
+    if key is None or stop_times_df.empty:
+        return
+
+    try:
+        pd.to_pickle({"stop_times": stop_times_df, "stop_map": stop_map}, GTFS_CACHE_PATH)
+        GTFS_CACHE_META_PATH.write_text(json.dumps(key), encoding="utf-8")
+        logger.info("Cache dati filtrati salvata in %s", GTFS_CACHE_PATH)
+    except Exception:
+        logger.exception("Impossibile salvare la cache dei dati filtrati")
+        GTFS_CACHE_META_PATH.unlink(missing_ok=True)
+
+
 def load_gtfs_data():
     """
     Carica il feed GTFS e prepara i dati filtrati per le fermate.
     Restituisce (feed, service_ids_by_date, stops, stop_times_df, stop_map).
+    Se la cache su disco è valida il feed non viene letto: feed e
+    service_ids_by_date sono allora None.
     """
+    cached = load_filtered_cache()
+    if cached is not None:
+        stop_times_df, stop_map = cached
+        logger.info("Dati filtrati caricati dalla cache: %d righe per %d fermate", len(stop_times_df), len(stop_map))
+        return None, None, list(stop_map.values()), stop_times_df, stop_map
+
     logger.info("Caricamento feed GTFS...")
-    filter_stop_times_file(GTFS_PATH / "stop_times.txt", TARGET_STOPS)
-    feed = ptg.load_feed(str(GTFS_PATH))
-    service_ids_by_date = ptg.read_service_ids_by_date(str(GTFS_PATH))
+    filter_stop_times_file(GTFS_PATH / "stop_times.txt", TARGET_STOP_IDS)
+    feed = load_feed_lite(GTFS_PATH)
+    service_ids_by_date = read_service_ids_by_date(GTFS_PATH)
     logger.info("Feed GTFS caricato: %d fermate, %d stop_times", len(feed.stops), len(feed.stop_times))
 
     stops = get_nearby_stops(feed)
@@ -473,6 +731,7 @@ def load_gtfs_data():
 
     logger.info("Filtraggio dati per fermate selezionate...")
     stop_times_df, stop_map = filter_stop_times(feed, stops, service_ids_by_date)
+    save_filtered_cache(stop_times_df, stop_map)
 
     return feed, service_ids_by_date, stops, stop_times_df, stop_map
 
@@ -491,9 +750,59 @@ def should_update_gtfs(last_download_date):
     return is_friday and is_after_2355 and not_downloaded_today
 
 
+def publish_latest(gtfs_queue, item):
+    """
+    Inserisce item nella coda (maxsize=1) scartando il valore non ancora letto.
+    """
+    try:
+        gtfs_queue.get_nowait()
+    except queue.Empty:
+        pass
+    gtfs_queue.put_nowait(item)
+
+
+def poll_gtfs_updates(gtfs_queue, stop_event, last_download_date):
+    """
+    Producer: ogni POLL_INTERVAL secondi controlla se è ora dell'aggiornamento
+    settimanale GTFS; in tal caso scarica e ricarica i dati (operazione lenta)
+    senza bloccare il display e pubblica il nuovo stop_times_df in gtfs_queue.
+    Termina quando stop_event viene impostato.
+    """
+    global _last_full_refresh
+    while not stop_event.wait(POLL_INTERVAL):
+        try:
+            # Controlla se è ora di aggiornare i dati GTFS (venerdì dopo 23:55)
+            if should_update_gtfs(last_download_date):
+                logger.info("=== Aggiornamento settimanale GTFS ===")
+                download_gtfs_data()
+                last_download_date = datetime.now().date()
+                feed, service_ids_by_date, stops, stop_times_df, stop_map = load_gtfs_data()
+                _last_full_refresh = None
+                publish_latest(gtfs_queue, stop_times_df)
+
+        except Exception:
+            logger.exception("Errore aggiornamento dati GTFS")
+            stop_event.wait(60)  # Riprova tra 1 minuto in caso di errore
+
+
+def refresh_display(arrivals, now):
+    """
+    Ridisegna l'immagine con arrivi e orario correnti e aggiorna il display.
+    """
+    # Crea immagine
+    logger.info("Creazione immagine display...")
+    image = create_display_image(arrivals, now)
+
+    # Aggiorna display
+    logger.info("Aggiornamento display...")
+    update_display(image)
+
+
 def main():
     """
-    Loop principale
+    Loop principale: un thread gestisce l'aggiornamento settimanale GTFS, il
+    thread principale calcola gli arrivi e aggiorna il display ogni
+    UPDATE_INTERVAL secondi.
     """
     logger.info("=== Display Trasporti Milano - Piazza Ferravilla ===")
     logger.info("Avvio alle %s", datetime.now())
@@ -508,33 +817,39 @@ def main():
 
     # Carica feed GTFS in memoria
     feed, service_ids_by_date, stops, stop_times_df, stop_map = load_gtfs_data()
-    global _update_counter
+
+    gtfs_queue = queue.Queue(maxsize=1)
+    stop_event = threading.Event()
+    producer = threading.Thread(
+        target=poll_gtfs_updates,
+        args=(gtfs_queue, stop_event, last_download_date),
+        name="gtfs-updater",
+        daemon=True,
+    )
+    producer.start()
+
     while True:
         try:
-            # Controlla se è ora di aggiornare i dati GTFS (venerdì dopo 23:55)
-            if should_update_gtfs(last_download_date):
-                logger.info("=== Aggiornamento settimanale GTFS ===")
-                download_gtfs_data()
-                _update_counter = 0
-                last_download_date = datetime.now().date()
-                feed, service_ids_by_date, stops, stop_times_df, stop_map = load_gtfs_data()
+            # Usa i dati ricaricati dal producer, se ce ne sono
+            try:
+                stop_times_df = gtfs_queue.get_nowait()
+            except queue.Empty:
+                pass
 
-            # Interroga i dati pre-filtrati (operazione leggera)
-            logger.info("Recupero dati arrivi...")
-            arrivals = get_next_arrivals(stop_times_df, stop_map)
+            # Un solo istante di riferimento, preso al momento del rendering
+            now = datetime.now()
 
-            # Stampa arrivi
-            logger.info("Arrivi alle %s:", datetime.now().strftime('%H:%M'))
-            for a in arrivals:
-                logger.info("  Linea %3s → %-40s %3s min", a['line'], a['destination'], a['minutes'])
+            # Interroga i dati pre-filtrati (operazione leggera)
+            logger.debug("Recupero dati arrivi...")
+            arrivals = get_next_arrivals(stop_times_df, now)
 
-            # Crea immagine
-            logger.info("Creazione immagine display...")
-            image = create_display_image(arrivals)
+            # Riepilogo a INFO, dettaglio per arrivo solo a DEBUG
+            logger.info("Arrivi alle %s: %d (prossimo in %d min)", now.strftime('%H:%M'), len(arrivals), arrivals[0]['minutes'] if arrivals else -1)
+            if logger.isEnabledFor(logging.DEBUG):
+                for a in arrivals:
+                    logger.debug("  Linea %3s → %-40s %3s min", a['line'], a['destination'], a['minutes'])
 
-            # Aggiorna display
-            logger.info("Aggiornamento display...")
-            update_display(image)
+            refresh_display(arrivals, now)
 
             # Attendi prima del prossimo aggiornamento
             logger.info("Prossimo aggiornamento tra %s secondi", UPDATE_INTERVAL)
@@ -542,6 +857,8 @@ def main():
 
         except KeyboardInterrupt:
             logger.info("Uscita... pulisco il display")
+            stop_event.set()
+            producer.join(timeout=5)
             epd = _get_epd()
             epd.init()
             epd.Clear() # Pulisce prima di uscire